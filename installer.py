@@ -1,6 +1,9 @@
 import os
-import subprocess 
-import shlex
+import sys
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run.py")
+#default target survives SteamOS updates - override with an argument or XIVOMEGA_BIN
+DEST = "/var/lib/flatpak/exports/bin/xivomega"
 
 class RootRequiredError(RuntimeError):
     pass
@@ -11,40 +14,72 @@ class BinaryExistsException(Exception):
 class NotAcceptedException(Exception):
 	pass
 
-try:
-	if os.getuid() != 0:
-		raise RootRequiredError
+def install(dest):
+	try:
+		if os.getuid() != 0:
+			raise RootRequiredError
+
+		#single lstat - anything already sitting at dest counts as installed
+		try:
+			os.lstat(dest)
+			raise BinaryExistsException
+		except FileNotFoundError:
+			pass
 
-	if os.path.isfile('/var/lib/flatpak/exports/bin/xivomega'):
-		raise BinaryExistsException
+		print("*************************************")
+		print("RUN THIS ONLY IF USING FROM STEAM DECK!")
+		print("If using from Linux, just run 'sudo ./run.py'")
+		print("*************************************")
+		print("Welcome to the installer for XIVOmega")
+		print(f"This will install the binary for xivomega on {os.path.dirname(dest)}")
+		print("This is done to avoid SteamOS wiping the binary when upadting the firmware")
+		ins = input("Please confirm installation (Y/N):\n")
 
-	print("*************************************")
-	print("RUN THIS ONLY IF USING FROM STEAM DECK!")
-	print("If using from Linux, just run 'sudo ./run.py'")
-	print("*************************************")
-	print("Welcome to the installer for XIVOmega")
-	print("This will install the binary for xivomega on /var/lib/flatpak/exports/bin")
-	print("This is done to avoid SteamOS wiping the binary when upadting the firmware")
-	ins = input("Please confirm installation (Y/N):\n")
+		if ins[:1] in ("n","N"):
+			raise NotAcceptedException
+		else:
+			#copy in-kernel with the final mode set at creation - source is never touched
+			src = os.open(APP_PATH, os.O_RDONLY)
+			try:
+				size = os.fstat(src).st_size
+				#O_EXCL - something created at dest since the check above is never overwritten or followed
+				try:
+					dst = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o755)
+				except FileExistsError:
+					raise BinaryExistsException
+				try:
+					#the mode given to open() is cut down by the umask - set it explicitly
+					os.fchmod(dst, 0o755)
+					offset = 0
+					while offset < size:
+						sent = os.sendfile(dst, src, offset, size - offset)
+						if sent == 0:
+							#source got shorter while copying - don't spin on it
+							raise OSError(f"{APP_PATH} changed while being copied")
+						offset += sent
+				except BaseException:
+					#a half-written copy would pass for an existing install next time
+					os.unlink(dest)
+					raise
+				finally:
+					os.close(dst)
+			finally:
+				os.close(src)
+			print(f"Binary successfully installed to {dest}")
+			print("To run program, type 'sudo xivomega'.")
 
-	if ins.lower() == "n":
-		raise NotAcceptedException 
-	else:
-		app_path = os.getcwd() + "/run.py"
-		os.chmod(app_path, 0o777)
-		subprocess.run(shlex.split("cp " + app_path + " /var/lib/flatpak/exports/bin/xivomega"))
-		print("Binary successfully installed to /var/lib/flatpak/exports/bin/xivomega")
-		print("To run program, type 'sudo xivomega'.")
+	except RootRequiredError:
+		print("This program requires root permissions - use sudo")
 
-except RootRequiredError:
-	print("This program requires root permissions - use sudo") 
+	except BinaryExistsException:
+		print("Binary executable already installed.")
 
-except BinaryExistsException:
-	print("Binary executable already installed.")
+	except NotAcceptedException:
+		print("Installation not accepted. Good Bye")
 
-except NotAcceptedException:
-	print("Installation not accepted. Good Bye")
+if __name__ == "__main__":
+	install(sys.argv[1] if len(sys.argv) > 1 else os.environ.get("XIVOMEGA_BIN", DEST))
 
 
 
-#/usr/local/sbin:/usr/local/bin:/usr/bin:/var/lib/flatpak/exports/bin:/usr/bin/site_perl:/usr/bin/vendor_perl:/usr/bin/core_perl
\ No newline at end of file
+#/usr/local/sbin:/usr/local/bin:/usr/bin:/var/lib/flatpak/exports/bin:/usr/bin/site_perl:/usr/bin/vendor_perl:/usr/bin/core_perl
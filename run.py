@@ -4,51 +4,57 @@ import sys
 import os
 import ipaddress
 import struct
+import fcntl
 import subprocess
 from subprocess import Popen, PIPE, CalledProcessError
 from getpass import getpass
-import shlex
+import shutil
 import time
+import types
 import io
-import configparser
+import re
+import functools
 import gi
 gi.require_version("NM", "1.0")
 from gi.repository import GLib, NM
-from pathlib import Path
 import random 
 from random import randint, sample
 
-#append py_modules to PYTHONPATH
-sys.path.append(str(Path(__file__).parent / "py_modules"))
-
-from scapy.all import ARP, Ether, srp
-
 #pth = "/home/deck/xivomega/"
 pth = os.getcwd()
 
 #region aux functions and classes
 class WorkerClass:
+	def __init__(self):
+		self._netdevices = None
+
+	def GetNetDevices(self):
+		#NM.Client.new walks every device over D-Bus - do it once per run and keep the NMDevice objects
+		if self._netdevices is None:
+			client = NM.Client.new(None)
+			self._netdevices = {d.get_iface(): d for d in client.get_devices()}
+		return self._netdevices
+
+	def ResetDevices(self):
+		#drop the NM client and device map - the next GetNetDevices() builds them again
+		self._netdevices = None
+
 	def get_current_device(self):
-		client = NM.Client.new(None)
-		devices = client.get_devices()
-		netdevices = {}
 		curr_netd = ""
 		saved_eth = {}
 		saved_wifi = {}
 		#test_flag = 'Y'
 
-		for device in devices:
-		    netdevices[device.get_iface()] = device.get_type_description() + ";" + device.get_state().value_nick
-
 		i = 1
 		j = 1
 	#priority is ethernet first, then wifi - if more than one of each, then make user pick
-		for netd, netdet in netdevices.items():
-			netd_type, netd_state = netdet.split(";")
-			if netd_type in ("ethernet") and netd_state in ("activated"):
+		for netd, device in self.GetNetDevices().items():
+			netd_type = device.get_type_description()
+			netd_state = device.get_state().value_nick
+			if netd_type == "ethernet" and netd_state == "activated":
 				saved_eth[i] = netd #ethernet = enp0s*
 				i += 1
-			elif netd_type in ("wifi") and netd_state in ("activated"):
+			elif netd_type == "wifi" and netd_state == "activated":
 				saved_wifi[j] = netd #wifi = wlan* or wlp*
 				j += 1
 		
@@ -65,9 +71,10 @@ class WorkerClass:
 				for k,v in saved_eth.items():
 					print(f"{k} - {v}")
 				pref_adapter = input("Enter the number of the adapter you would like to use: ")
+				#only a number from the list above gets through - anything else asks again
 				try:
-					curr_netd = saved_eth.get(int(pref_adapter))
-				except Exception as e:
+					curr_netd = saved_eth[int(pref_adapter)]
+				except (ValueError, KeyError):
 					print("The option selected is not valid. Please select a valid option")
 					continue
 				else:
@@ -83,9 +90,10 @@ class WorkerClass:
 				for k,v in saved_wifi.items():
 					print(f"{k} - {v}")
 				pref_adapter = input("Enter the number of the adapter you would like to use: ")
+				#only a number from the list above gets through - anything else asks again
 				try:
-					curr_netd = saved_wifi.get(int(pref_adapter))
-				except Exception as e:
+					curr_netd = saved_wifi[int(pref_adapter)]
+				except (ValueError, KeyError):
 					print("The option selected is not valid. Please select a valid option")
 					continue
 				else:
@@ -96,15 +104,10 @@ class WorkerClass:
 		return curr_netd #you get nothing, you lose, good day, sir!
 	
 	def validateCustomNetDev(self,dev_name):
-		client = NM.Client.new(None)
-		devices = client.get_devices()
-		netdevices = {}
 		valid_dev = ''
 
-		for device in devices:
-		    netdevices[device.get_iface()] = device.get_type_description() + ";" + device.get_state().value_nick
-
-		if dev_name not in netdevices.keys():
+		#must be a device NM knows about - the cached map is reused by get_current_device if we have to ask
+		if dev_name not in self.GetNetDevices():
 			print("Invalid Network Adapter specified in config file")
 			print("XIVOmega will now retrieve the actual list of devices, so please pick one")
 			valid_dev = self.get_current_device()
@@ -115,8 +118,7 @@ class WorkerClass:
 
 
 	def fixPodmanStorage(self):
-		podstorecmd = f"cp {pth}/storage/storage.conf /etc/containers/storage.conf"
-		psf = subprocess.run(shlex.split(podstorecmd),check=True,capture_output=True)
+		psf = subprocess.run(["cp",f"{pth}/storage/storage.conf","/etc/containers/storage.conf"],check=True,capture_output=True)
 		try:
 		   	if psf.returncode==0:
 		   		#print(f"/etc/containers/storage.conf was patched")
@@ -125,252 +127,288 @@ class WorkerClass:
 			print(e.stderr.decode())
 
 	def SetRoutes(self,rt14):
-		for r in rt14:
-			way = f"ip route add {r} via 10.88.0.7"
-			nav = subprocess.run(shlex.split(way),check=True,capture_output=True)
-			try:
-		   		if nav.returncode==0:
-		   			print(f"route to {r} added")
-			except subprocess.CalledProcessError as e:
-				print(e.stderr.decode())
+		#all routes through one ip process - batch stops at the first failure
+		way = ROUTES_ADD if rt14 is roadsto14 else "".join(f"route add {r} via {OMEGA_IP}\n" for r in rt14).encode()
+		nav = subprocess.run([IP_BIN,"-batch","-"],input=way,check=True,capture_output=True)
+		try:
+			if nav.returncode==0:
+				for r in rt14:
+					print(f"route to {r} added")
+		except subprocess.CalledProcessError as e:
+			print(e.stderr.decode())
+
+	def MissingRoutes(self):
+		#podman restart usually leaves the host routes alone - only the ones that are gone need adding again
+		via = f" via {OMEGA_IP} "
+		rtab = subprocess.run([IP_BIN,"-4","route","show"],capture_output=True).stdout.decode()
+		existing = {l.split(" ",1)[0] for l in rtab.splitlines() if via in l}
+		return [r for r in roadsto14 if r not in existing]
 
 	def ClearNetavarkRules(self):
-		subprocess.run(shlex.split("iptables -F INPUT"),check=True,capture_output=True)
-		subprocess.run(shlex.split("iptables -F FORWARD"),check=True,capture_output=True)
-		subprocess.run(shlex.split("iptables -F OUTPUT"),check=True,capture_output=True)
+		#flush all three chains in a single iptables-restore commit
+		subprocess.run([IPTRESTORE_BIN,"--noflush","--wait"],input=NETAVARK_FLUSH,check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
 
 	def PrintLogo(self):
-		subprocess.call(pth + "/titleCard.sh")
+		#banner is static - write it out instead of forking bash to echo it
+		banner = read_banner(pth + "/titleCard.sh")
+		if banner is None:
+			subprocess.call(pth + "/titleCard.sh")
+		else:
+			sys.stdout.write(banner)
+			sys.stdout.flush()
 
 	def ReconnectProtocol(self):
-		subprocess.run(shlex.split("podman restart xivomega"),check=True,capture_output=True)
-		subprocess.run(shlex.split("podman exec xivomega iptables -t nat -F POSTROUTING"),check=True,capture_output=True)
-		subprocess.run(shlex.split("podman exec xivomega /home/iptset.sh"),check=True,capture_output=True)
+		subprocess.run([PODMAN_BIN,"restart","xivomega"],check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+		#flush and re-apply in one exec - each podman exec has to join the container again
+		subprocess.run([PODMAN_BIN,"exec","xivomega","sh","-c","iptables -t nat -F POSTROUTING && /home/iptset.sh"],check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
 
 	def CDTimer(self):
+		#nobody sees the countdown when stdout is not a terminal - just wait it out
+		if not sys.stdout.isatty():
+			time.sleep(10)
+			return
 		for i in range(10, 0, -1):
-			print(i, end = ' \r')
+			print(i, end = ' \r', flush = True)
 			time.sleep(1)
 
 	def CreateHostAdapter(self,virtual_ip,netbits,broadcast,ntdev):
 		#ntdev = self.get_current_device()
-		ipvl1 = f"ip link add xivlanh link {ntdev} type ipvlan mode l2"
-		ipvl2 = f"ip addr add {virtual_ip}/{netbits} brd {broadcast} dev xivlanh"
-		ipvl3 = f"ip link set xivlanh up"
-		
-		try:
-			ipvlh1 = subprocess.run(shlex.split(ipvl1),check=True,capture_output=True)
-			if ipvlh1.returncode == 0:
-				print("host ipvlan interface created")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		
-		try:
-			ipvlh2 = subprocess.run(shlex.split(ipvl2),check=True,capture_output=True)
-			if ipvlh2.returncode == 0:
-				print(f"host ipvlan interface IP is {virtual_ip}")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		
-		try:
-			ipvlh3 = subprocess.run(shlex.split(ipvl3),check=True,capture_output=True)
-			if ipvlh3.returncode == 0:
-				print("host ipvlan interface is up")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
+		#add, address and bring up in one ip process - -force carries on past a failed step like the separate calls did
+		ipvl = (f"link add xivlanh link {ntdev} type ipvlan mode l2\n"
+			f"addr add {virtual_ip}/{netbits} brd {broadcast} dev xivlanh\n"
+			"link set xivlanh up\n").encode()
+		failed = ip_force_batch(ipvl)
+		if 1 not in failed:
+			print("host ipvlan interface created")
+		if 2 not in failed:
+			print(f"host ipvlan interface IP is {virtual_ip}")
+		if 3 not in failed:
+			print("host ipvlan interface is up")
 
 	def SelfDestructProtocol(self):
 		print("Terminating Mitigation Protocol and XIVOmega")
-		for r in roadsto14:
-			way = f"ip route del {r} via 10.88.0.7"
-			nav = subprocess.run(shlex.split(way),check=True,capture_output=True)
+		#routes and host ipvlan in one ip process - -force keeps going past a failed line and names it on stderr
+		failed = ip_force_batch(ROUTES_DEL + HOSTLAN_DEL)
+		for n, r in enumerate(roadsto14, 1):
+			if n not in failed:
+				print(f"route to {r} deleted")
+		for msg, argv in TEARDOWN_CMDS:
 			try:
-		   		if nav.returncode==0:
-		   			print(f"route to {r} deleted")
+				step = subprocess.run(argv,check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+				if step.returncode == 0:
+					print(msg)
 			except subprocess.CalledProcessError as e:
-					print(e.stderr.decode())
-		try:
-			panto = subprocess.run(shlex.split("podman stop xivomega"),check=True,capture_output=True)
-			if panto.returncode == 0:
-				print("XIVOmega Container Stopped")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		try:
-			atomic = subprocess.run(shlex.split("podman network disconnect xivlanc xivomega"),check=True,capture_output=True)
-			if atomic.returncode == 0:
-				print("XIVOmega IPVlan Disconnected")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		try:
-			flame = subprocess.run(shlex.split("podman network rm xivlanc"),check=True,capture_output=True)
-			if flame.returncode == 0:
-				print("XIVOmega IPVlan Removed")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		try:
-			bworld = subprocess.run(shlex.split("podman rm xivomega"),check=True,capture_output=True)
-			if bworld.returncode == 0:
-				print("XIVOmega Container removed")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		try:
-			lanhdie = subprocess.run(shlex.split("ip link set xivlanh down"),check=True,capture_output=True)
-			if lanhdie.returncode == 0:
-				print("Host IPVlan turned off")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
-		try:
-			lanhrm = subprocess.run(shlex.split("ip link del xivlanh"),check=True,capture_output=True)
-			if lanhrm.returncode == 0:
-				print("Host IPVlan removed")
-		except subprocess.CalledProcessError as e:
-			print(e.stderr.decode())
+				print(e.stderr.decode())
+		if len(roadsto14) + 1 not in failed:
+			print("Host IPVlan turned off")
+		if len(roadsto14) + 2 not in failed:
+			print("Host IPVlan removed")
 		print("All done - Goodbye")
 
 #Self Cleaning - in case last session was ended by user and they didn't closed using Ctrl+C
 	def SelfCleaningProtocol(self):
 		ccnt = 0
-		for r in roadsto14:
-			way = f"ip route del {r} via 10.88.0.7"
-			try:
-				nav = subprocess.run(shlex.split(way),check=True,capture_output=True)
-				if nav.returncode==0:
-		   			ccnt = ccnt + 1
-		   			#print(f"route to {r} deleted")
-			except subprocess.CalledProcessError as e:
-				#print(e.stderr.decode())
-				pass
-		try:
-			bworld = subprocess.run(shlex.split("podman stop xivomega"),check=True,capture_output=True)
-			if bworld.returncode == 0:
-				ccnt = ccnt + 1
-		except subprocess.CalledProcessError as e:
-			pass
-			#print(e.stderr.decode())
+		#one ip process for the routes and the host ipvlan - every failed line reports "Command failed"
+		nav = subprocess.run([IP_BIN,"-force","-batch","-"],input=ROUTES_DEL + HOSTLAN_DEL,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+		ccnt = ccnt + len(roadsto14) + 2 - len(BATCH_FAIL_RE.findall(nav.stderr))
 		try:
-			bworld = subprocess.run(shlex.split("podman rm xivomega"),check=True,capture_output=True)
+			#rm -f stops the container first, one podman call instead of two
+			bworld = subprocess.run([PODMAN_BIN,"rm","-f","xivomega"],check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
 			if bworld.returncode == 0:
 				ccnt = ccnt + 1
 		except subprocess.CalledProcessError as e:
 			pass
 			#print(e.stderr.decode())
 		try:
-			flame = subprocess.run(shlex.split("podman network rm xivlanc"),check=True,capture_output=True)
+			flame = subprocess.run([PODMAN_BIN,"network","rm","xivlanc"],check=True,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
 			if flame.returncode == 0:
 				ccnt = ccnt + 1
 		except subprocess.CalledProcessError as e:
 			pass
 			#print(e.stderr.decode())
-		try:
-			lanhdie = subprocess.run(shlex.split("ip link set xivlanh down"),check=True,capture_output=True)
-			if lanhdie.returncode == 0:
-				ccnt = ccnt + 1
-		except subprocess.CalledProcessError as e:
-			pass
-			#print(e.stderr.decode())
-		try:
-			lanhrm = subprocess.run(shlex.split("ip link del xivlanh"),check=True,capture_output=True)
-			if lanhrm.returncode == 0:
-				ccnt = ccnt +1
-		except subprocess.CalledProcessError as e:
-			pass
 		if (ccnt > 0):
 			print("Dangling elements from previous play session detected. CleanUp Protocol Activated and Completed")
 
 
-#read config file
+#ip -batch and interface helpers
+
+def ip_force_batch(script):
+	#run an ip -force -batch script, print what went wrong and return the numbers of the lines that failed
+	nav = subprocess.run([IP_BIN,"-force","-batch","-"],input=script,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE)
+	failed = {int(n) for n in BATCH_FAIL_RE.findall(nav.stderr)}
+	if failed:
+		print(BATCH_FAIL_RE.sub(b"",nav.stderr).decode().strip())
+	return failed
+
+#get IPv4 address and netmask of a device straight from the kernel
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
 
-#get subnet mask and subnet
-def cidr_to_netmask(cidr):
-	network, net_bits = cidr.split('/')
-	host_bits = 32 - int(net_bits)
-	netmask = socket.inet_ntoa(struct.pack('!I',(1 << 32) - (1 << host_bits)))
-	return network, netmask
+def get_if_inet(ifname):
+	s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	ifreq = struct.pack('256s', ifname[:15].encode())
+	try:
+		addr = fcntl.ioctl(s.fileno(), SIOCGIFADDR, ifreq)[20:24]
+		mask = fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, ifreq)[20:24]
+	finally:
+		s.close()
+	return socket.inet_ntoa(addr), socket.inet_ntoa(mask)
 
 #get config files parms
+#config.ini only has three keys under [General] - pick them out directly, ; and # comment lines never match
+CFG_RE = re.compile(r'^[ \t]*(ipvlan_host|ipvlan_cont|network_adapter)[ \t]*[=:][ \t]*(.*?)[ \t]*$', re.I | re.M)
+
 def read_config():
-	cfg = configparser.ConfigParser()
-	cfg.read(pth + '/config.ini')
+	#parsed values are reused until config.ini changes on disk
+	cfg_path = pth + '/config.ini'
+	try:
+		mtime = os.stat(cfg_path).st_mtime_ns
+	except FileNotFoundError:
+		mtime = None
+	return read_config_file(cfg_path, mtime)
+
+@functools.lru_cache(maxsize=4)
+def read_config_file(cfg_path, mtime):
+	try:
+		with open(cfg_path) as f:
+			cfg = {k.lower(): v for k, v in CFG_RE.findall(f.read())}
+	except FileNotFoundError:
+		cfg = {}
 
-	ipvlan_host = cfg.get('General','ipvlan_host').lower()
-	ipvlan_cont = cfg.get('General','ipvlan_cont').lower()
-	pref_netdev = cfg.get('General','network_adapter')
+	ipvlan_host = cfg.get('ipvlan_host','default').lower()
+	ipvlan_cont = cfg.get('ipvlan_cont','default').lower()
+	pref_netdev = cfg.get('network_adapter','default')
 
-	#create dictionary with Config Parms
-	cfg_val = {
+	#create dictionary with Config Parms - read-only since it is shared between calls
+	cfg_val = types.MappingProxyType({
 	'ipvlan_host': ipvlan_host,
 	'ipvlan_cont': ipvlan_cont,
 	'network_adapter': pref_netdev
-	}
+	})
 
 	return cfg_val
 
-#validate IP Address
+#titleCard.sh is just colour variables and echo -e lines - expand them here
+BANNER_VAR_RE = re.compile(r"^(\w+)='([^']*)'", re.M)
+BANNER_ECHO_RE = re.compile(r'^echo -e "(.*)";?[ \t]*$', re.M)
+
+@functools.lru_cache(maxsize=1)
+def read_banner(card_path):
+	try:
+		with open(card_path, encoding="utf-8") as f:
+			card = f.read()
+	except OSError:
+		return None
+	lines = BANNER_ECHO_RE.findall(card)
+	if not lines:
+		return None
+	banner = "\n".join(lines) + "\n"
+	for k, v in BANNER_VAR_RE.findall(card):
+		banner = banner.replace("${" + k + "}", v)
+	return banner.replace("\\033", "\033")
+
+#validate IP Address - config values don't change during a run, so remember the answer
+#inet_pton is always there on Linux and rejects the short/hex forms inet_aton lets through
+@functools.lru_cache(maxsize=256)
 def is_valid_ipv4_address(address):
-    try:
-        socket.inet_pton(socket.AF_INET, address)
-    except AttributeError:  # no inet_pton here, sorry
-        try:
-            socket.inet_aton(address)
-        except socket.error:
-            return False
-        return address.count('.') == 3
-    except socket.error:  # not a valid address
-        return False
-
-    return True
-
-#scapy methods to get network info - get all IPs in use
-def scan(ip):
-	arp_request = Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=ip)
-	result = srp(arp_request, timeout=1, verbose=False)[0]
-	devices = [{'ip': received.psrc, 'mac': received.hwsrc} for sent, received in result]
+	try:
+		socket.inet_pton(socket.AF_INET, address)
+	except OSError:  # not a valid address
+		return False
+	return True
+
+#ARP scan to get network info - get all IPs in use
+#who-has request over a raw packet socket - the frame layout is fixed, so no need to load scapy for it
+ETH_P_ARP = 0x0806
+ARP_REQ_HDR = struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1) #ethernet/ipv4, who-has
+ARP_REPLY_HDR = struct.pack("!HHBBH", 1, 0x0800, 6, 4, 2) #ethernet/ipv4, is-at
+
+def scan(ip, iface, timeout=1):
+	devices = []
+	s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+	try:
+		s.bind((iface, ETH_P_ARP))
+		hwaddr = s.getsockname()[4]
+		psrc = socket.inet_aton(get_if_inet(iface)[0])
+		pdst = socket.inet_aton(ip)
+		s.send(b"\xff" * 6 + hwaddr + struct.pack("!H", ETH_P_ARP) + ARP_REQ_HDR + hwaddr + psrc + b"\x00" * 6 + pdst)
+		deadline = time.monotonic() + timeout
+		while True:
+			left = deadline - time.monotonic()
+			if left <= 0:
+				break
+			s.settimeout(left)
+			try:
+				frame = s.recv(2048)
+			except socket.timeout:
+				break
+			#only an is-at for the address asked about counts as an answer
+			if len(frame) < 42 or frame[14:22] != ARP_REPLY_HDR or frame[28:32] != pdst:
+				continue
+			devices.append({'ip': ip, 'mac': frame[22:28].hex(':')})
+			break
+	finally:
+		s.close()
 	return devices
 
-def get_device_names(devices):
-	device_names = []
-	for device in devices:
-		try:
-			host_name, _, _ = socket.gethostbyaddr(device['ip'])
-			device_names.append({'ip': device['ip'], 'mac': device['mac'], 'name': host_name})
-		except socket.herror:
-		   
-			device_names.append({'ip': device['ip'], 'mac': device['mac'], 'name': 'Unknown'})
-	return device_names
-
-def get_vip_lip(ipaddr,subnaddr):
+def get_vip_lip(ipaddr,subnaddr,iface):
 	ips = []
 	target_ip = ipaddr
-	devices_list = scan(target_ip)
+	devices_list = scan(target_ip, iface)
 	for device in devices_list:
-		for k,v in device.items():
-			if k in 'ip':
-				ips.append(device[k])
-	devices_with_names = get_device_names(devices_list)
+		ips.append(device['ip'])
 	
 	print("IPs in use:")
 	for uip in ips:
 		print(uip)
-	allip = [str(ip) for ip in ipaddress.IPv4Network(subnaddr)]
-	useable_ip = allip[3:-2]
-	# Removing elements present in other list
-	# using list comprehension
-	res = [i for i in useable_ip if i not in ips]
+	#work on the integer form of the subnet - skip the first three and last two addresses as before
+	net = ipaddress.IPv4Network(subnaddr)
+	base = int(net.network_address)
+	used = {int(ipaddress.IPv4Address(uip)) for uip in ips}
+	res = [a for a in range(base + 3, base + net.num_addresses - 2) if a not in used]
 	print("Chosen IPs:")
-	vip, lip = sample(res,2)
+	vip, lip = (str(ipaddress.IPv4Address(a)) for a in sample(res,2))
 	print(f"VlanIP: {vip}")
 	print(f"Last IP: {lip}")
 	return vip, lip
 
-#end of scapy methods
+#end of ARP scan methods
 
 
 #end aux region
 
 #Static knicknacks
 
+#resolve the tools once - a missing one keeps its bare name and still fails when run, as before
+IP_BIN = shutil.which("ip") or "ip"
+PODMAN_BIN = shutil.which("podman") or "podman"
+IPTRESTORE_BIN = shutil.which("iptables-restore") or "iptables-restore"
+
+#reachability probe - returns on the first echo reply instead of always sitting through five, gives up after 5s
+PING_PROBE = [PODMAN_BIN,"exec","xivomega","ping","-c","1","-w","5","204.2.29.7"]
+
+NETAVARK_FLUSH = b"*filter\n-F INPUT\n-F FORWARD\n-F OUTPUT\nCOMMIT\n"
+
+#container address on the podman network - every route below goes through it
+OMEGA_IP = "10.88.0.7"
+
 roadsto14 = ["124.150.157.0/24","153.254.80.0/24","202.67.52.0/24","204.2.29.0/24","80.239.145.0/24"]
 
+#ip -batch scripts for the routes above - built once at load, the CIDRs are checked here instead of by ip at teardown
+ROUTES_ADD = "".join(f"route add {ipaddress.ip_network(r)} via {OMEGA_IP}\n" for r in roadsto14).encode()
+ROUTES_DEL = ROUTES_ADD.replace(b"route add ", b"route del ")
+HOSTLAN_DEL = b"link set xivlanh down\nlink del xivlanh\n"
+#ip -batch reports each failed line as "Command failed -:<line>"
+BATCH_FAIL_RE = re.compile(rb"^Command failed -:(\d+)\n?", re.M)
+
+#container teardown, in order - message printed when the step succeeds
+TEARDOWN_CMDS = [
+	("XIVOmega Container Stopped", [PODMAN_BIN,"stop","xivomega"]),
+	("XIVOmega IPVlan Disconnected", [PODMAN_BIN,"network","disconnect","xivlanc","xivomega"]),
+	("XIVOmega IPVlan Removed", [PODMAN_BIN,"network","rm","xivlanc"]),
+	("XIVOmega Container removed", [PODMAN_BIN,"rm","xivomega"]),
+]
+
 #Custom Classes and Exceptions
 class RootRequiredError(RuntimeError):
     pass
@@ -420,54 +458,44 @@ def __main__() -> int:
 		else:
 			netdev = omegaBeetle.validateCustomNetDev(config_v['network_adapter'])
 
-		ipv4 = os.popen('ip addr show ' + netdev).read().split("inet ")[1].split(" brd")[0] 
+		ipv4n, nmask = get_if_inet(netdev)
+		ipv4 = ipaddress.ip_interface(ipv4n + '/' + nmask)
 		#print(ipv4)
-		ipv4n, netb = ipv4.split('/')
+		netb = str(ipv4.network.prefixlen)
 		
-		#print(cidr_to_netmask(ipv4)[1])
-		subn = ipaddress.ip_network(cidr_to_netmask(ipv4)[0]+'/'+cidr_to_netmask(ipv4)[1], strict=False)
-		sdgway = '.'.join(ipv4n.split('.')[:3]) + ".1"
-		#brd = '.'.join(ipv4n.split('.')[:3]) + ".255"
-		sdsubn = str(subn.network_address) + "/" + netb
+		subn = ipv4.network
+		#first host of the subnet, not .1 of the first three octets - they only agree on a /24
+		sdgway = str(subn.network_address + 1)
+		sdsubn = str(subn)
 		
 		#get first and last ips from current network
 		
 		#use config file - validate if values are not Default first
-		nt = ipaddress.IPv4Network(sdsubn)
-		fip = str(nt[1])
 
-		dvip, dlip = get_vip_lip(ipv4n,subn)
-
-		if config_v['ipvlan_host'] != 'default' and config_v['ipvlan_cont'] != 'default' :
-			if is_valid_ipv4_address(config_v['ipvlan_host']) == True and is_valid_ipv4_address(config_v['ipvlan_host']) == True:
-				vip = config_v['ipvlan_host']
-				lip = config_v['ipvlan_cont']
-			else:
-				raise InvalidIPException
-		elif config_v['ipvlan_host'] != 'default' and config_v['ipvlan_cont'] == 'default': 
-			if is_valid_ipv4_address(config_v['ipvlan_host']) == True:
-				vip = config_v['ipvlan_host']
-				lip = dlip
-			else:
+		#each value is either 'default' (take the scanned IP) or has to be a valid IPv4
+		vip = config_v['ipvlan_host']
+		lip = config_v['ipvlan_cont']
+		for cip in (vip, lip):
+			if cip != 'default' and not is_valid_ipv4_address(cip):
 				raise InvalidIPException
-		elif config_v['ipvlan_host'] == 'default' and config_v['ipvlan_cont'] != 'default': 
-			if is_valid_ipv4_address(config_v['ipvlan_cont']) == True:
+
+		#scan and reverse lookups only when one of them still has to be picked
+		if vip == 'default' or lip == 'default':
+			dvip, dlip = get_vip_lip(ipv4n,subn,netdev)
+			if vip == 'default':
 				vip = dvip
-				lip = config_v['ipvlan_cont']
-			else:
-				raise InvalidIPException
-		else: 
-			vip, lip = dvip, dlip
+			if lip == 'default':
+				lip = dlip
 
-		brd = str(nt.broadcast_address)
+		brd = str(subn.broadcast_address)
 
 		#create podman network
 		#This is using ipvlan 		
 		print("Welcome to XIVOmega v.0.01a")
 		print(f"Network Adapter in use: {netdev}")
-		podnet = f"podman network create --subnet={sdsubn} --gateway={sdgway} --driver=ipvlan -o parent={netdev} xivlanc"
+		podnet = [PODMAN_BIN,"network","create",f"--subnet={sdsubn}",f"--gateway={sdgway}","--driver=ipvlan","-o",f"parent={netdev}","xivlanc"]
 		try:
-			xivnet = subprocess.run(shlex.split(podnet),check=True,capture_output=True)  # shell=False
+			xivnet = subprocess.run(podnet,check=True,capture_output=True)  # shell=False
 			if xivnet.returncode == 0:
 				print("podman ipvlan network xivlanc has been created")
 		except subprocess.CalledProcessError as e: 
@@ -479,22 +507,22 @@ def __main__() -> int:
 				
 		print("Creating podman container")
 		
-		#create podman container - assigns IP 10.88.0.7 because yes
+		#create podman container - assigns IP OMEGA_IP (10.88.0.7) because yes
 		#todo: manually assign via config file
 		#desired end state: get dhcp - maybe in the future as podman makes it available
 		
-		omegapod = f"""podman create \
-		  --replace \
-		  --name=xivomega \
-		  --ip=10.88.0.7 \
-		  --sysctl net.ipv4.ip_forward=1 \
-		  --sysctl net.ipv4.conf.all.route_localnet=1 \
-		  --net=podman \
-		  --cap-add=NET_RAW,NET_ADMIN \
-		  -ti quay.io/shingonati0n/xivomega:latest /bin/sh"""
+		omegapod = [PODMAN_BIN,"create",
+		  "--replace",
+		  "--name=xivomega",
+		  f"--ip={OMEGA_IP}",
+		  "--sysctl","net.ipv4.ip_forward=1",
+		  "--sysctl","net.ipv4.conf.all.route_localnet=1",
+		  "--net=podman",
+		  "--cap-add=NET_RAW,NET_ADMIN",
+		  "-ti","quay.io/shingonati0n/xivomega:latest","/bin/sh"]
 		
 		try:
-			xivomega = subprocess.run(shlex.split(omegapod),check=True,capture_output=True)
+			xivomega = subprocess.run(omegapod,check=True,capture_output=True)
 			if xivomega.returncode == 0:
 				print("podman container created successfully")
 		except subprocess.CalledProcessError as e:
@@ -502,9 +530,9 @@ def __main__() -> int:
 			rc = -1
 		
 		#connect created container to podman ipvlan network - using IP address from either default or config file
-		hclosew = f"podman network connect xivlanc xivomega --ip={lip}"
+		hclosew = [PODMAN_BIN,"network","connect","xivlanc","xivomega",f"--ip={lip}"]
 		try:
-			hclosew = subprocess.run(shlex.split(hclosew),check=True,capture_output=True)
+			hclosew = subprocess.run(hclosew,check=True,capture_output=True)
 			if hclosew.returncode == 0:
 				print("hooked to podman ipvlan network")
 		except subprocess.CalledProcessError as e:
@@ -515,7 +543,7 @@ def __main__() -> int:
 		omegaBeetle.PrintLogo() 
 		#subprocess.call(pth + "titleCard.sh")
 		try:
-			hworld = subprocess.run(shlex.split("podman start xivomega"),check=True,capture_output=True)
+			hworld = subprocess.run([PODMAN_BIN,"start","xivomega"],check=True,capture_output=True)
 			if hworld.returncode == 0:
 				print("XIVOmega says - Hello World")
 		except subprocess.CalledProcessError as e:
@@ -531,7 +559,7 @@ def __main__() -> int:
 		
 		#run iptables on podman
 		try:
-			cosmo = subprocess.run(shlex.split("podman exec xivomega /home/iptset.sh"),check=True,capture_output=True)
+			cosmo = subprocess.run([PODMAN_BIN,"exec","xivomega","/home/iptset.sh"],check=True,capture_output=True)
 			if cosmo.returncode == 0:
 				print("IPTables in Omega: Complete")
 		except subprocess.CalledProcessError as e:
@@ -541,33 +569,32 @@ def __main__() -> int:
 		print("Establishing network connection...")
 		while(ctx > 0):
 			try:
-				dice = subprocess.run(shlex.split("podman exec xivomega ping 204.2.29.7 -c 5"),check=True,capture_output=True)
+				dice = subprocess.run(PING_PROBE,check=True,capture_output=True)
 				if dice.returncode == 0:
 					print("Network Established")
 					ctx = 0
-				else:
-					print("Retrying Connection..")
-					ctx = ctx + 1
-					omegaBeetle.ReconnectProtocol()
-					omegaBeetle.ClearNetavarkRules()
-					omegaBeetle.SetRoutes(roadsto14)
-					if(ctx > 5):
-						raise ConnectionFailedError
 			except subprocess.CalledProcessError as e:
 				print("Retrying Connection...")
 				ctx = ctx + 1
-				omegaBeetle.ReconnectProtocol()
-				omegaBeetle.ClearNetavarkRules()
-				omegaBeetle.SetRoutes(roadsto14)
 				if(ctx > 5):
 					raise ConnectionFailedError
+				#one lost probe is not worth a container restart - probe again first, rebuild from the second failure on
+				if ctx > 2:
+					omegaBeetle.ReconnectProtocol()
+					omegaBeetle.ClearNetavarkRules()
+					missing = omegaBeetle.MissingRoutes()
+					if missing:
+						omegaBeetle.SetRoutes(missing)
 
 		print("Mitigation in 10 seconds...")
 		omegaBeetle.CDTimer()
 		print("MITIGATOR EXECUTING")
 		#execute mitigator
-		omega = f"podman exec -it xivomega /home/omega_alpha.sh"
-		Popen(shlex.split(omega), stdout=sys.stdout, stderr=sys.stderr).communicate()
+		omega = [PODMAN_BIN,"exec","-it","xivomega","/home/omega_alpha.sh"]
+		#the NM device map is not needed again - let it go before sitting out the whole session
+		omegaBeetle.ResetDevices()
+		#the child inherits the terminal directly - nothing to proxy, just wait for it so teardown still runs here
+		Popen(omega).wait()
 	
 	except RootRequiredError:
 		print("This program requires root permissions - use sudo")